@@ -1,14 +1,15 @@
 import logging
 import os
-import glob
+import shlex
 import pathlib
+import itertools
 import subprocess
-from collections import defaultdict
+from typing import Dict
 
 from prompt_toolkit import prompt
 from prompt_toolkit.completion import Completer, Completion
 
-from .utils import Config, Cache, NoteFormatError
+from .utils import Config, Cache, NoteFormatError, compile_search_pattern
 
 
 _logger = logging.getLogger(__name__)
@@ -19,6 +20,7 @@ ACTION_CREATE_NAME = 'create'
 ACTION_DELETE_NAME = 'delete'
 ACTION_RESTORE_NAME = 'restore'
 ACTION_QUIT_CODE = "q"
+MAX_RESULTS = 200
 
 
 class QuickNoteCompleter(Completer):
@@ -28,29 +30,26 @@ class QuickNoteCompleter(Completer):
 
         self._actions = self._config.get('actions')
         self._search_by = self._config.get('search_by')
+        self._action_options = self._get_options(self._actions)
+        self._search_by_options = self._get_options(self._search_by)
+        self._last_search = None
+        self._last_completions = None
+
+    @staticmethod
+    def _get_options(config):
+        return ', '.join(f"{v['name']}({key})" for key, v in config.items())
 
     def _get_action_hint(self, action):
         if action in self._actions:
-            hint = self._actions[action]['hint']
-        else:
-            action_keys = list(self._actions.keys())
-            action_names = [v['name'] for v in self._actions.values()]
-            action_options = [f"{name}({key})" for name, key in zip(action_names, action_keys)]
-            hint = f"action '{action}' undefined, should be one of {', '.join(action_options)}"
+            return self._actions[action]['hint']
 
-        return hint
+        return f"action '{action}' undefined, should be one of {self._action_options}"
 
     def _get_search_by_hint(self, search_by):
         if search_by in self._search_by:
-            hint = self._search_by[search_by]['hint']
-        else:
-            search_by_keys = list(self._search_by.keys())
-            search_by_names = [v['name'] for v in self._search_by.values()]
-            search_by_options = [f"{name}({key})" for name, key in zip(search_by_names, search_by_keys)]
-
-            hint = f"search by '{search_by}' undefined, should be one of {', '.join(search_by_options)}"
+            return self._search_by[search_by]['hint']
 
-        return hint
+        return f"search by '{search_by}' undefined, should be one of {self._search_by_options}"
 
     def _completion_generator(self, document):
         user_input = document.text.lstrip()
@@ -95,63 +94,124 @@ class QuickNoteCompleter(Completer):
             else:
                 return
 
-            if search_by == 't':
-                if keywords.strip():
-                    search_tags = keywords.split(',')
-
-                    tags = [tag for tag in self._cache.tags.keys() if any(t for t in search_tags if t in tag)]
-                    for t in sorted(tags):
-                        for note in self._cache.tags[t]:
-                            yield Completion(
-                                text=action_name + ' ' + note,
-                                start_position=-len(document.text_before_cursor),
-                                display=self._cache.notes[note]['name'],
-                                display_meta='#' + t,
-                            )
-                else:
-                    for tag in sorted(self._cache.tags.keys()):
-                        yield Completion(
-                            text=' ',
-                            start_position=-len(document.text_before_cursor),
-                            display=f"#{tag} ({len(self._cache.tags[tag])} notes)",
-                        )
-            elif search_by == 'n':
-                if keywords.strip():
-                    names = [h for h in self._cache.names.keys() if keywords.lower() in h.lower()]
-                else:
-                    names = [h for h in self._cache.names.keys()]
-
-                for name in names:
-                    note = self._cache.names[name]
-                    tags = self._cache.notes[note]['tags']
-                    tags = '#' + ' #'.join(tags) if tags else ''
-
+            if search_by == 't' and not keywords.strip():
+                self._last_search = None
+                sorted_tags = self._cache.sorted_tags_snapshot
+                for tag in itertools.islice(sorted_tags, MAX_RESULTS):
                     yield Completion(
-                        text=action_name + ' ' + self._cache.names[name],
+                        text=' ',
                         start_position=-len(document.text_before_cursor),
-                        display=name,
-                        display_meta=tags,
+                        display=f"#{tag} ({len(self._cache.tags_snapshot.get(tag, ()))} notes)",
                     )
+
+                if len(sorted_tags) > MAX_RESULTS:
+                    yield self._truncated_completion()
+                return
+
+            revision = self._cache.revision
+
+            if search_by == 't':
+                query, matches = None, self._search_tags(keywords)
+            elif search_by == 'n':
+                query = keywords.lower() if keywords.strip() else ''
+                matches = (self._narrow_last_search(search_by, query, lambda name_lower: query in name_lower)
+                           or self._search_names(query))
             elif search_by == 'c' and len(keywords.strip()) >= 2:
-                p = subprocess.Popen(
-                    [f"grep -in '{keywords}' {self._config.get('note.location')}/*.md"],
-                    shell=True,
-                    stdout=subprocess.PIPE,
-                )
+                # narrowing must match lines exactly like a fresh search does
+                query, pattern = keywords, compile_search_pattern(keywords)
+                matches = self._narrow_last_search(search_by, query, pattern.search) or self._search_content(keywords)
+            else:
+                self._last_search = None
+                return
 
-                for line in p.stdout:
-                    note_path, match = line.decode('UTF-8').split(':', 1)
-                    note_name = self._cache.notes[note_path]['name']
+            self._last_search = None
 
-                    yield Completion(
-                        text=action_name + ' ' + note_path,
-                        start_position=-len(document.text_before_cursor),
-                        display=note_name,
-                        display_meta=match.strip(),
-                    )
+            # completions are streamed as they are found, the matches are only kept for narrowing the next query
+            # when the search ran to completion without hitting MAX_RESULTS
+            found = []
+            for match in itertools.islice(matches, MAX_RESULTS + 1):
+                if len(found) == MAX_RESULTS:
+                    yield self._truncated_completion()
+                    return
+
+                found.append(match)
+
+                _, note, display, display_meta = match
+                yield Completion(
+                    text=action_name + ' ' + note,
+                    start_position=-len(document.text_before_cursor),
+                    display=display,
+                    display_meta=display_meta,
+                )
+
+            if query is not None:
+                self._last_search = (revision, search_by, query, found)
+
+    def _narrow_last_search(self, search_by, query, matcher):
+        # a longer query only matches a subset of the previous (haystack, note, display, display_meta) results,
+        # which are only kept when the previous search was not cut short
+        if self._last_search is None:
+            return None
+
+        revision, last_search_by, last_query, last_matches = self._last_search
+        if revision != self._cache.revision or last_search_by != search_by or not query.startswith(last_query):
+            return None
+
+        return (m for m in last_matches if matcher(m[0]))
+
+    @staticmethod
+    def _truncated_completion():
+        # selecting it inserts nothing and leaves the input untouched
+        return Completion(text='', start_position=0, display="… more, keep typing")
+
+    def _search_tags(self, keywords):
+        note_names = self._cache.note_names_snapshot
+        tags = self._cache.tag_index.lookup_any(keywords.split(','))
+        for t in sorted(tags):
+            for note in self._cache.tags_snapshot.get(t, ()):
+                note_name = note_names.get(note)
+                if note_name is not None:
+                    yield None, note, note_name, '#' + t
+
+    def _search_names(self, query):
+        names, note_tags = self._cache.names_snapshot, self._cache.note_tags_snapshot
+        # the snapshots are updated in place, iterate a copy taken in one C call
+        for name, name_lower in tuple(self._cache.names_lower.items()):
+            note = names.get(name)
+            if query in name_lower and note is not None:
+                tags = note_tags.get(note, ())
+                tags = '#' + ' #'.join(tags) if tags else ''
+
+                yield name_lower, note, name, tags
+
+    def _search_content(self, keywords):
+        note_names = self._cache.note_names_snapshot
+        for note_path, line_number, line in self._cache.search_content(keywords):
+            note_name = note_names.get(note_path)
+            if note_name is not None:
+                yield line, note_path, note_name, f"{line_number}:{line.strip()}"
 
     def get_completions(self, document, complete_event):
-        yield from self._completion_generator(document)
+        # prompt_toolkit also asks again on events that leave the input untouched, replay the previous completions
+        key = (self._cache.revision, document.text, document.cursor_position)
+        if self._last_completions is not None and self._last_completions[0] == key:
+            yield from self._last_completions[1]
+            return
+
+        completions = []
+        for completion in self._completion_generator(document):
+            completions.append(completion)
+            yield completion
+
+        self._last_completions = (key, completions)
+
+
+def run_executor(executor: str, note):
+    # run the executor directly rather than through a shell, note paths are passed as a single argument
+    try:
+        subprocess.run([*shlex.split(executor), str(note)])
+    except (OSError, ValueError) as e:  # shlex raises ValueError on unbalanced quotes
+        print(f"Failed to run executor {executor}: {e}")
 
 
 def create_note(config: Config, cache: Cache, operation: str):
@@ -173,7 +233,7 @@ def create_note(config: Config, cache: Cache, operation: str):
         with open(note, 'w') as f:
             f.write(note_name + '\n\n#tag')
 
-    os.system(f"{executor} {note}")
+    run_executor(executor, note)
 
     try:
         cached_note = cache.cache_note(note)
@@ -206,18 +266,25 @@ def restore_note(config: Config, cache: Cache, operation: str):
     print(f"Restored {restored_note}")
 
 
-def operate_note(config: Config, cache: Cache, operation: str):
-    action_name, note_path = operation.split()
+def get_executors(config: Config) -> Dict[str, str]:
+    return {
+        action_config['name']: action_config['executor']
+        for action_config in config.get('actions').values()
+        if 'executor' in action_config
+    }
+
 
-    executor = [action_config['executor']
-                for _, action_config in config.get('actions').items()
-                if action_config['name'] == action_name][0]
+def operate_note(cache: Cache, operation: str, executors: Dict[str, str]):
+    action_name, note_path = operation.split()
+    if action_name not in executors:
+        print(f"Action '{action_name}' has no executor configured")
+        return
 
-    os.system(f"{executor} {note_path}")
+    run_executor(executors[action_name], note_path)
     cache.cache_note(pathlib.Path(note_path))
 
 
-def handle_operation(config: Config, cache: Cache, operation: str):
+def handle_operation(config: Config, cache: Cache, operation: str, executors: Dict[str, str]):
     if not operation:
         return
 
@@ -230,7 +297,7 @@ def handle_operation(config: Config, cache: Cache, operation: str):
     elif operation.split()[0] == ACTION_RESTORE_NAME:
         restore_note(config, cache, operation)
     else:
-        operate_note(config, cache, operation)
+        operate_note(cache, operation, executors)
 
 def cli(debug: bool = True):
     logging.basicConfig(level='INFO')
@@ -245,12 +312,13 @@ def cli(debug: bool = True):
     cache = Cache(config=config, path=config.get('note.location'), ext=config.get('note.file_ext'))
 
     completer = QuickNoteCompleter(config, cache)
+    executors = get_executors(config)
     while True:
         prompt_str = config.get('app.prompt', 'quick-note> ')
 
         try:
-            operation = prompt(prompt_str, completer=completer).strip()
-            handle_operation(config, cache, operation)
+            operation = prompt(prompt_str, completer=completer, complete_in_thread=True).strip()
+            handle_operation(config, cache, operation, executors)
         except KeyboardInterrupt as e:
             print("quick-notes terminated")
             break
\ No newline at end of file
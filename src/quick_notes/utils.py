@@ -1,25 +1,101 @@
 import os
+import re
 import yaml
+import bisect
+import pickle
 import shutil
 import logging
 import pathlib
 from collections import defaultdict
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Set, List, Tuple, Iterator, Iterable
 
 
 _logger = logging.getLogger(__name__)
 
+READ_WORKERS = 8
+INDEX_VERSION = 3
+DEFAULT_INDEX_PATH = "~/.cache/quick-notes/index.pkl"
+
+
+def compile_search_pattern(keywords: str) -> re.Pattern:
+    return re.compile(re.escape(keywords), re.IGNORECASE)
+
 
 class NoteFormatError(Exception):
     pass
 
 
+class ConfigError(Exception):
+    pass
+
+
+class TagIndex:
+    """Substring index over tags.
+
+    Each tag is posted under all its substrings of up to GRAM_SIZE characters. A term of at most GRAM_SIZE characters
+    is answered by its own posting, a longer term only verifies the tags sharing all of its trigrams.
+    """
+
+    GRAM_SIZE = 3
+
+    def __init__(self):
+        self.tags = set()
+        self.grams = defaultdict(set)
+
+    @classmethod
+    def _grams(cls, text: str, size: int) -> Set[str]:
+        return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+    @classmethod
+    def _tag_grams(cls, tag: str) -> Set[str]:
+        return set().union(*(cls._grams(tag, size) for size in range(1, cls.GRAM_SIZE + 1)))
+
+    def add(self, tag: str):
+        self.tags.add(tag)
+        for gram in self._tag_grams(tag):
+            self.grams[gram].add(tag)
+
+    def remove(self, tag: str):
+        self.tags.discard(tag)
+        for gram in self._tag_grams(tag):
+            posting = self.grams.get(gram)
+            if posting is None:
+                continue
+
+            posting.discard(tag)
+            if not posting:
+                del self.grams[gram]
+
+    def lookup(self, term: str) -> Set[str]:
+        if not term:
+            return set(self.tags)
+
+        if len(term) <= self.GRAM_SIZE:
+            return set(self.grams.get(term, ()))
+
+        postings = sorted((self.grams.get(gram, set()) for gram in self._grams(term, self.GRAM_SIZE)), key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        return {tag for tag in candidates if term in tag}
+
+    def lookup_any(self, terms: Iterable[str]) -> Set[str]:
+        # a term containing another term can only match a subset of that term's tags, skip it
+        needed = []
+        for term in sorted(set(t for t in terms if t), key=len):
+            if not any(t in term for t in needed):
+                needed.append(term)
+
+        return set().union(*(self.lookup(t) for t in needed))
+
+
 class Config:
     MANDATORY_CONFIG = 'MANDATORY_CONFIG'
 
     def __init__(self, path: str):
         config_path = pathlib.Path(path).expanduser()
         self._config = self.load_config(config_path)
+        # config is immutable at runtime, resolve every dotted path once
+        self._flat = dict(self.flatten_config(self._config))
 
     def validate_config(self):
         assert 'actions' in self._config
@@ -40,18 +116,22 @@ class Config:
         #self.validate_config()
         return cfg
 
-    def get(self, path: str, default: Any = MANDATORY_CONFIG):
-        cfg = self._config
+    @classmethod
+    def flatten_config(cls, cfg: Dict[str, Any], prefix: str = '') -> Iterator[Tuple[str, Any]]:
+        for key, value in cfg.items():
+            path = f"{prefix}{key}"
+            yield path, value
 
-        for key in path.split('.'):
-            if key in cfg:
-                cfg = cfg[key]
-            elif default is MANDATORY_CONFIG:
-                raise ConfigError(f"Mandatory config {path} is not defined")
-            else:
-                return default
+            if isinstance(value, dict):
+                yield from cls.flatten_config(value, prefix=f"{path}.")
 
-        return cfg
+    def get(self, path: str, default: Any = MANDATORY_CONFIG):
+        if path in self._flat:
+            return self._flat[path]
+        elif default is self.MANDATORY_CONFIG:
+            raise ConfigError(f"Mandatory config {path} is not defined")
+        else:
+            return default
 
 
 class Cache:
@@ -59,13 +139,32 @@ class Cache:
         self._config = config
         self._ext = ext
         self._note_path = pathlib.Path(path).expanduser()
+        self._index_path = pathlib.Path(config.get('note.cache_path', DEFAULT_INDEX_PATH)).expanduser()
         if not self._note_path.exists():
             self._note_path.mkdir()
             _logger.info("Created directory {note_path} for note keeping")
 
         self.names = dict()
         self.tags = defaultdict(set)
-        self.notes = dict()
+        self.note_names: Dict[str, str] = dict()
+        self.note_tags: Dict[str, Tuple[str, ...]] = dict()
+        self._note_bodies: Dict[str, str] = dict()
+        self.tag_index = TagIndex()
+        self.sorted_tags: List[str] = []
+        # views for readers, the completer may read them while a note is being cached. They are only updated, for the
+        # keys an operation touched, once the operation is complete
+        self.tags_snapshot: Dict[str, Tuple[str, ...]] = dict()
+        self.sorted_tags_snapshot: Tuple[str, ...] = ()
+        self.note_names_snapshot: Dict[str, str] = dict()
+        self.note_tags_snapshot: Dict[str, Tuple[str, ...]] = dict()
+        self.names_snapshot: Dict[str, str] = dict()
+        self.names_lower: Dict[str, str] = dict()
+        self._dirty_tags: Set[str] = set()
+        # insertion ordered, so the views keep the order notes were cached in
+        self._dirty_notes: Dict[str, None] = dict()
+        self._dirty_names: Dict[str, None] = dict()
+        # bumped on every change so consumers can tell when derived results went stale
+        self.revision = 0
 
         self._cache_notes()
 
@@ -78,71 +177,232 @@ class Cache:
         return note_path
 
     @classmethod
-    def extract_note_name(cls, note: pathlib.Path):
-        with open(note, 'r') as f:
-            l = f.readline()
+    def extract_note_header(cls, content: str) -> Tuple[str, List[str]]:
+        lines = content.split('\n', 2)
+        name_line = lines[0]
+        tags_line = lines[1] if len(lines) > 1 else ''
 
-            if not l.strip().startswith('##'):
-                raise NoteFormatError("first line does not start with '##'")
-            else:
-                return l.lstrip('##').strip()
+        if not name_line.strip().startswith('##'):
+            raise NoteFormatError("first line does not start with '##'")
 
-    @classmethod
-    def extract_note_tags(cls, note: pathlib.Path):
-        with open(note, 'r') as f:
-            l = f.readline()
-            if not l.strip().startswith('##'):
-                raise NoteFormatError("first line does not start with '##'")
+        if not tags_line.strip().startswith('#'):  # TODO: use regex for a strict pattern match
+            raise NoteFormatError("second line does not start with '#', should be tags. e.g. '#python #101'")
 
-            l = f.readline()
-            if not l.strip().startswith('#'):  # TODO: use regex for a strict pattern match
-                raise NoteFormatError("second line does not start with '#', should be tags. e.g. '#python #101'")
+        note_name = name_line.lstrip('##').strip()
+        tags = [t[1:].strip() for t in tags_line.split()]
+        return note_name, tags
 
-            tags = [t[1:].strip() for t in l.split()]
-            return tags
+    def uncache_note(self, note: pathlib.Path):
+        self._uncache_note(note)
+        self._snapshot()
 
-    def uncache_note(self, note: pathlib.Path) -> pathlib.Path:
-        if str(note) not in self.notes:
+    def _uncache_note(self, note: pathlib.Path):
+        key = str(note)
+        if key not in self.note_names:
             return
 
-        note_name = self.notes[str(note)]['name']
-        tags = self.notes[str(note)]['tags']
+        self.revision += 1
+        note_name = self.note_names[key]
+        tags = self.note_tags[key]
 
         del self.names[note_name]
-        for tag in tags:
-            self.tags[tag].remove(str(note))
-
-        del self.notes[str(note)]
+        for tag in set(tags):
+            self._remove_tag(tag, key)
+
+        del self.note_names[key]
+        del self.note_tags[key]
+        del self._note_bodies[key]
+        self._dirty_notes[key] = None
+        self._dirty_names[note_name] = None
+
+    def _remove_tag(self, tag: str, note: str):
+        self._dirty_tags.add(tag)
+        self.tags[tag].remove(note)
+        if not self.tags[tag]:
+            del self.tags[tag]
+            self.tag_index.remove(tag)
+            del self.sorted_tags[bisect.bisect_left(self.sorted_tags, tag)]
+
+    def _snapshot(self):
+        # additions are published before tags point at them and removals after, so a reader never finds a note that
+        # is cached under one key or the other missing, e.g. while it is being renamed
+        for note in self._dirty_notes:
+            if note in self.note_names:
+                self.note_names_snapshot[note] = self.note_names[note]
+                self.note_tags_snapshot[note] = self.note_tags[note]
+
+        for name in self._dirty_names:
+            if name in self.names:
+                self.names_snapshot[name] = self.names[name]
+                self.names_lower[name] = name.lower()
+
+        if self._dirty_tags:
+            for tag in self._dirty_tags:
+                if tag in self.tags:
+                    self.tags_snapshot[tag] = tuple(sorted(self.tags[tag]))
+                else:
+                    self.tags_snapshot.pop(tag, None)
+
+            self.sorted_tags_snapshot = tuple(self.sorted_tags)
+            self._dirty_tags.clear()
+
+        for name in self._dirty_names:
+            if name not in self.names:
+                self.names_lower.pop(name, None)
+                self.names_snapshot.pop(name, None)
+
+        for note in self._dirty_notes:
+            if note not in self.note_names:
+                self.note_names_snapshot.pop(note, None)
+                self.note_tags_snapshot.pop(note, None)
+
+        self._dirty_notes.clear()
+        self._dirty_names.clear()
 
     def cache_note(self, note: pathlib.Path) -> Optional[pathlib.Path]:
         if not note.exists():
             self.uncache_note(note)
             return
         else:
-            note_name = self.extract_note_name(note)
-            tags = self.extract_note_tags(note)
-
-            new_note = self.get_note_path_for_note_name(note_name)
-            if new_note != note:
-                note.rename(new_note)
-                self.uncache_note(note)
-
-            self.names[note_name] = str(new_note)
-
-            prev_tags = self.notes.get(str(new_note), {}).get('tags', [])
-            for prev_tag in prev_tags:
-                if prev_tag not in tags:
-                    self.tags[prev_tag].remove(str(new_note))
+            new_note = self._apply_note(note, *self._read_note(note))
+            self._snapshot()
+            return new_note
 
-            for tag in tags:
-                self.tags[tag].add(str(new_note))
+    @classmethod
+    def _read_note(cls, note: pathlib.Path) -> Tuple[str, str, List[str]]:
+        content = note.read_bytes().decode('utf-8', errors='replace')
+        note_name, tags = cls.extract_note_header(content)
+        return content, note_name, tags
+
+    def _apply_note(self, note: pathlib.Path, content: str, note_name: str, tags: List[str]) -> pathlib.Path:
+        new_note = self.get_note_path_for_note_name(note_name)
+        if new_note != note:
+            note.rename(new_note)
+            self._uncache_note(note)
+
+        key = str(new_note)
+        self.revision += 1
+        self.names[note_name] = key
+
+        prev_tags = set(self.note_tags.get(key, ()))
+        new_tags = set(tags)
+        for prev_tag in prev_tags - new_tags:
+            self._remove_tag(prev_tag, key)
+
+        for tag in new_tags - prev_tags:
+            if tag not in self.tags:
+                self.tag_index.add(tag)
+                bisect.insort(self.sorted_tags, tag)
+            self._dirty_tags.add(tag)
+            self.tags[tag].add(key)
+
+        self.note_names[key] = note_name
+        self.note_tags[key] = tuple(tags)
+        self._note_bodies[key] = content
+        self._dirty_notes[key] = None
+        self._dirty_names[note_name] = None
+        return new_note
 
-            self.notes[str(new_note)] = dict(name=note_name, tags=tags)
-            return new_note
+    @classmethod
+    def _match_lines(cls, pattern: re.Pattern, content: str) -> List[Tuple[int, str]]:
+        lines = []
+        line_number, line_start, pos = 1, 0, 0
+
+        while True:
+            m = pattern.search(content, pos)
+            if m is None:
+                return lines
+
+            start = content.rfind('\n', 0, m.start()) + 1
+            end = content.find('\n', m.end())
+            if end == -1:
+                end = len(content)
+
+            line_number += content[line_start:start].count('\n')
+            line_start = start
+            lines.append((line_number, content[start:end]))
+            pos = end + 1
+
+    def search_content(self, keywords: str) -> Iterator[Tuple[str, int, str]]:
+        pattern = compile_search_pattern(keywords)
+
+        for note, content in list(self._note_bodies.items()):
+            for line_number, line in self._match_lines(pattern, content):
+                yield note, line_number, line
+
+    @staticmethod
+    def _stamp(stat: os.stat_result) -> Tuple[int, int, int]:
+        return stat.st_mtime_ns, stat.st_size, stat.st_ctime_ns
+
+    def _load_index(self) -> Dict[str, Tuple[Tuple[int, int, int], str, str, List[str]]]:
+        if not self._index_path.exists():
+            return dict()
+
+        try:
+            with open(self._index_path, 'rb') as f:
+                version, entries = pickle.load(f)
+        except Exception as e:
+            _logger.warning(f"Ignored unreadable index {self._index_path}: {e}")
+            return dict()
+
+        if version != INDEX_VERSION:
+            return dict()
+
+        return entries
+
+    def _save_index(self, stamps: Dict[str, Tuple[int, int, int]]):
+        entries = {
+            key: (stamps[key], self._note_bodies[key], note_name, list(self.note_tags[key]))
+            for key, note_name in self.note_names.items()
+        }
+
+        try:
+            self._index_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._index_path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                pickle.dump((INDEX_VERSION, entries), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._index_path)
+        except OSError as e:
+            _logger.warning(f"Failed to save index {self._index_path}: {e}")
 
     def _cache_notes(self):
-        for note in self._note_path.glob(f"*.{self._ext}"):
-            try:
-                self.cache_note(note)
-            except NoteFormatError as e:
-                _logger.error(f"Failed to load {note}: {e}")
\ No newline at end of file
+        index = self._load_index()
+
+        suffix = f".{self._ext}"
+        notes, stale, stamps = [], [], dict()
+        with os.scandir(self._note_path) as entries:
+            for entry in entries:
+                if not entry.name.endswith(suffix) or not entry.is_file():
+                    continue
+
+                note = pathlib.Path(entry.path)
+                notes.append(note)
+                stamps[entry.path] = self._stamp(entry.stat())
+
+                # a note is read again unless its mtime, size and ctime are the ones it was indexed with, tools like
+                # rsync -a or cp -p can deliver new content with an old mtime but cannot restore the ctime
+                if entry.path not in index or index[entry.path][0] != stamps[entry.path]:
+                    stale.append(note)
+
+        changed = False
+        # reading is IO bound and runs in parallel, the cache itself is only written from this thread
+        with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+            futures = {note: executor.submit(self._read_note, note) for note in stale}
+
+            for note in notes:
+                try:
+                    if note in futures:
+                        new_note = self._apply_note(note, *futures[note].result())
+                        changed = True
+                    else:
+                        new_note = self._apply_note(note, *index[str(note)][1:])
+                except NoteFormatError as e:
+                    _logger.error(f"Failed to load {note}: {e}")
+                    continue
+
+                if new_note != note:
+                    stamps[str(new_note)] = self._stamp(new_note.stat())
+
+        self._snapshot()
+        if changed or index.keys() != self.note_names.keys():
+            self._save_index(stamps)
@@ -7,4 +7,36 @@
     - https://docs.pytest.org/en/stable/writing_plugins.html
 """
 
-# import pytest
+import pathlib
+
+import pytest
+import yaml
+
+from quick_notes.utils import Config, Cache
+
+
+@pytest.fixture
+def note_dir(tmp_path):
+    path = tmp_path / "notes"
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def config(tmp_path, note_dir):
+    default_config = pathlib.Path(__file__).parents[1] / "src/quick_notes/resources/default-config.yaml"
+    cfg = yaml.safe_load(default_config.read_text())
+    cfg['note']['location'] = str(note_dir)
+    cfg['note']['cache_path'] = str(tmp_path / "cache" / "index.pkl")
+
+    config_path = tmp_path / "quick-notes.yaml"
+    config_path.write_text(yaml.safe_dump(cfg))
+    return Config(str(config_path))
+
+
+@pytest.fixture
+def make_cache(config, note_dir):
+    def _make_cache():
+        return Cache(config=config, path=str(note_dir), ext='md')
+
+    return _make_cache
@@ -0,0 +1,122 @@
+from prompt_toolkit.document import Document
+
+from quick_notes import cli
+from quick_notes.cli import QuickNoteCompleter
+
+__author__ = "Edwin He"
+__copyright__ = "Edwin He"
+__license__ = "MIT"
+
+
+def complete(completer, text):
+    return [(c.text, c.display_text, c.display_meta_text) for c in completer.get_completions(Document(text), None)]
+
+
+def test_narrowing_names(note_dir, config, make_cache, monkeypatch):
+    (note_dir / "python_tips.md").write_text("## Python Tips\n#python\n")
+    (note_dir / "bash_tricks.md").write_text("## Bash Tricks\n#bash\n")
+    cache = make_cache()
+    completer = QuickNoteCompleter(config, cache)
+
+    searches = []
+    search_names = completer._search_names
+    monkeypatch.setattr(completer, "_search_names", lambda query: searches.append(query) or search_names(query))
+
+    assert len(complete(completer, "en t")) == 2
+    narrowed = complete(completer, "en ti")
+    assert searches == ["t"]
+
+    # a separate completer has no previous results to narrow
+    assert narrowed == complete(QuickNoteCompleter(config, cache), "en ti")
+    assert [display for _, display, _ in narrowed] == ["Python Tips"]
+
+
+def test_narrowing_content_matches_fresh_search(note_dir, config, make_cache, monkeypatch):
+    (note_dir / "u.md").write_text("## U\n#u\nab ÄRGER\nab other\n")
+    cache = make_cache()
+    completer = QuickNoteCompleter(config, cache)
+
+    searches = []
+    search_content = completer._search_content
+    monkeypatch.setattr(
+        completer, "_search_content", lambda keywords: searches.append(keywords) or search_content(keywords)
+    )
+
+    assert len(complete(completer, "vc ab")) == 2
+    narrowed = complete(completer, "vc ab är")
+    assert searches == ["ab"]
+
+    assert narrowed == complete(QuickNoteCompleter(config, cache), "vc ab är")
+    assert [meta for _, _, meta in narrowed] == ["3:ab ÄRGER"]
+
+
+def test_truncated_completions(note_dir, config, make_cache, monkeypatch):
+    for name in ("a", "b", "c"):
+        (note_dir / f"{name}.md").write_text(f"## {name}\n#{name}\n")
+    completer = QuickNoteCompleter(config, make_cache())
+    monkeypatch.setattr(cli, "MAX_RESULTS", 2)
+
+    tags = complete(completer, "et ")
+    assert len(tags) == 3 and tags[-1] == ("", "… more, keep typing", "")
+
+    names = complete(completer, "en ")
+    assert len(names) == 3 and names[-1] == ("", "… more, keep typing", "")
+    assert completer._last_search is None
+
+
+def test_get_executors(config):
+    # actions without an executor, like delete and quit, are left out
+    assert cli.get_executors(config) == {"create": "vim", "view": "mdless", "edit": "vim"}
+
+
+def test_operate_note(note_dir, make_cache, capsys):
+    note = note_dir / "note.md"
+    note.write_text("## Note\n#a\n")
+    cache = make_cache()
+
+    cli.operate_note(cache, f"quit {note}", {"edit": "true"})
+    assert "Action 'quit' has no executor configured" in capsys.readouterr().out
+
+    note.write_text("## Note\n#b\n")
+    cli.operate_note(cache, f"edit {note}", {"edit": "true"})
+    assert cache.note_tags[str(note)] == ("b",)
+
+
+def test_run_executor(tmp_path, capsys):
+    note = tmp_path / "my note.md"
+    cli.run_executor("touch", note)
+    assert note.exists()
+
+    cli.run_executor("no-such-executor", note)
+    assert "Failed to run executor no-such-executor" in capsys.readouterr().out
+
+    cli.run_executor("vim '-R", note)
+    assert "Failed to run executor vim '-R" in capsys.readouterr().out
+
+    cli.run_executor(str(note), note)  # not executable
+    assert f"Failed to run executor {note}" in capsys.readouterr().out
+
+
+def test_completions_replayed_until_input_or_cache_changes(note_dir, config, make_cache, monkeypatch):
+    note = note_dir / "python_tips.md"
+    note.write_text("## Python Tips\n#python\n")
+    cache = make_cache()
+    completer = QuickNoteCompleter(config, cache)
+
+    documents = []
+    generator = completer._completion_generator
+    monkeypatch.setattr(completer, "_completion_generator", lambda document: documents.append(document) or generator(document))
+
+    first = complete(completer, "en py")
+    assert complete(completer, "en py") == first
+    assert len(documents) == 1
+
+    # moving the cursor is a different request
+    list(completer.get_completions(Document("en py", cursor_position=3), None))
+    assert len(documents) == 2
+
+    # a cache update bumps the revision, so the same input is searched again
+    note.write_text("## Python Tips\n#python #pytest\n")
+    cache.cache_note(note)
+    complete(completer, "en py")
+    assert len(documents) == 3
@@ -0,0 +1,180 @@
+import os
+
+import pytest
+
+from quick_notes.utils import Cache, Config, ConfigError, TagIndex, compile_search_pattern
+
+__author__ = "Edwin He"
+__copyright__ = "Edwin He"
+__license__ = "MIT"
+
+
+def test_tag_index_shared_substrings():
+    index = TagIndex()
+    for tag in ("python", "py3", "typing", "cython"):
+        index.add(tag)
+
+    assert index.lookup("py") == {"python", "py3"}
+    assert index.lookup("y") == {"python", "py3", "typing", "cython"}
+    assert index.lookup("ython") == {"python", "cython"}
+    assert index.lookup("yth") == {"python", "cython"}
+    assert index.lookup("xyz") == set()
+
+    index.remove("python")
+    assert index.lookup("py") == {"py3"}
+    assert index.lookup("typ") == {"typing"}
+    assert index.lookup("yth") == {"cython"}
+    assert "pyt" not in index.grams
+
+    index.remove("cython")
+    assert "yth" not in index.grams
+    assert index.lookup("yth") == set()
+
+
+def test_tag_index_short_terms_use_postings():
+    class NoScan(set):
+        def __iter__(self):
+            raise AssertionError("short terms must not scan every tag")
+
+    index = TagIndex()
+    for tag in ("python", "py3", "java"):
+        index.add(tag)
+    index.tags = NoScan(index.tags)
+
+    assert index.lookup("p") == {"python", "py3"}
+    assert index.lookup("av") == {"java"}
+    assert index.lookup("y3") == {"py3"}
+    assert index.lookup("pyt") == {"python"}
+    assert index.lookup("q") == set()
+
+
+def test_match_lines():
+    content = "## Note\n#tag\nfoo bar\nbaz\nFOO foo\nlast foo"
+    lines = Cache._match_lines(compile_search_pattern("foo"), content)
+    assert lines == [(3, "foo bar"), (5, "FOO foo"), (6, "last foo")]
+
+    lines = Cache._match_lines(compile_search_pattern("ärger"), "x\nab ÄRGER\n")
+    assert lines == [(2, "ab ÄRGER")]
+
+
+def test_config_flatten():
+    cfg = {"note": {"location": "~/notes", "file_ext": "md"}, "app": {"prompt": "> "}}
+    assert dict(Config.flatten_config(cfg)) == {
+        "note": {"location": "~/notes", "file_ext": "md"},
+        "note.location": "~/notes",
+        "note.file_ext": "md",
+        "app": {"prompt": "> "},
+        "app.prompt": "> ",
+    }
+
+
+def test_config_get(config, note_dir):
+    assert config.get("note.location") == str(note_dir)
+    assert config.get("actions.c.executor") == "vim"
+    assert set(config.get("search_by")) == {"t", "n", "c"}
+
+    assert config.get("app.missing", "default") == "default"
+    assert config.get("app.missing", None) is None
+
+    with pytest.raises(ConfigError):
+        config.get("app.missing")
+
+
+def test_index_invalidation(note_dir, make_cache, monkeypatch):
+    a, b = note_dir / "a.md", note_dir / "b.md"
+    a.write_text("## A\n#x\none\n")
+    b.write_text("## B\n#y\n")
+    make_cache()
+
+    reads, saves = [], []
+    read_note, save_index = Cache._read_note.__func__, Cache._save_index
+
+    def spy_read_note(cls, note):
+        reads.append(note.name)
+        return read_note(cls, note)
+
+    def spy_save_index(self, stamps):
+        saves.append(1)
+        return save_index(self, stamps)
+
+    monkeypatch.setattr(Cache, "_read_note", classmethod(spy_read_note))
+    monkeypatch.setattr(Cache, "_save_index", spy_save_index)
+
+    # unchanged notes come from the index, which is not written again
+    cache = make_cache()
+    assert reads == [] and saves == []
+    assert cache.note_tags[str(a)] == ("x",)
+
+    # new content with the old mtime is still picked up
+    stat = a.stat()
+    a.write_text("## A\n#z\ntwo\n")
+    os.utime(a, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    b.unlink()
+    cache = make_cache()
+    assert reads == ["a.md"] and saves == [1]
+    assert cache.note_tags[str(a)] == ("z",)
+    assert [n for n, _, _ in cache.search_content("two")] == [str(a)]
+    assert str(b) not in cache.note_names
+
+
+def test_cache_note_tag_diff(note_dir, make_cache):
+    note = note_dir / "note.md"
+    note.write_text("## Note\n#a #b #a\n")
+    cache = make_cache()
+    assert cache.sorted_tags == ["a", "b"]
+
+    note.write_text("## Note\n#b #c\n")
+    cache.cache_note(note)
+    key = str(note)
+    assert dict(cache.tags) == {"b": {key}, "c": {key}}
+    assert cache.sorted_tags == ["b", "c"]
+    assert cache.tags_snapshot == {"b": (key,), "c": (key,)}
+    assert cache.tag_index.lookup("a") == set()
+
+    note.unlink()
+    cache.cache_note(note)
+    assert dict(cache.tags) == {}
+    assert cache.sorted_tags == []
+    assert cache.tags_snapshot == {}
+
+
+def test_tag_index_lookup_any():
+    index = TagIndex()
+    for tag in ("python", "java", "javascript"):
+        index.add(tag)
+
+    assert index.lookup_any(["", "py", "python", "script"]) == {"python", "javascript"}
+    assert index.lookup_any(["", ""]) == set()
+
+
+def test_snapshots_after_rename_and_uncache(note_dir, make_cache, monkeypatch):
+    note = note_dir / "first_name.md"
+    note.write_text("## First Name\n#a #b\n")
+    cache = make_cache()
+    assert cache.note_names_snapshot == {str(note): "First Name"}
+
+    snapshots = []
+    snapshot = Cache._snapshot
+    monkeypatch.setattr(Cache, "_snapshot", lambda self: snapshots.append(1) or snapshot(self))
+
+    # renaming the note publishes the views once, with the note only under its new key
+    note.write_text("## Second Name\n#b #c\n")
+    renamed = cache.cache_note(note)
+    key = str(renamed)
+    assert renamed == note_dir / "second_name.md" and not note.exists()
+    assert snapshots == [1]
+    assert cache.note_names_snapshot == {key: "Second Name"}
+    assert cache.note_tags_snapshot == {key: ("b", "c")}
+    assert cache.names_snapshot == {"Second Name": key}
+    assert cache.names_lower == {"Second Name": "second name"}
+    assert cache.tags_snapshot == {"b": (key,), "c": (key,)}
+    assert cache.sorted_tags_snapshot == ("b", "c")
+
+    cache.uncache_note(renamed)
+    assert snapshots == [1, 1]
+    assert cache.note_names_snapshot == {}
+    assert cache.note_tags_snapshot == {}
+    assert cache.names_snapshot == {}
+    assert cache.names_lower == {}
+    assert cache.tags_snapshot == {}
+    assert cache.sorted_tags_snapshot == ()